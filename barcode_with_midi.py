@@ -1,11 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Tuple
-import mido
-import pygame
-import pygame.midi
-import time
+from functools import lru_cache
+from typing import List, Optional, Tuple
+import io
 import subprocess
+import time
+import threading
 import hashlib
+try:
+    import fluidsynth
+except ImportError:
+    # only needed for live playback; the MIDI helpers work without it
+    fluidsynth = None
+try:
+    import cups
+except ImportError:
+    # no pycups: run without printing
+    cups = None
 from barcode import Code128
 from barcode.writer import ImageWriter
 
@@ -17,31 +28,106 @@ class Note:
     duration_beats: float
     velocity: int = 80
 
+@dataclass
+class Chord:
+    mask: int                 # bit p set = pitch p sounds
+    velocity: int
+    duration_beats: float
+    bpm: int
+    program: int
+
+    @property
+    def seconds(self) -> float:
+        return self.duration_beats * 60.0 / self.bpm
+
+SF2_PATH = "/usr/share/sounds/sf2/FluidR3_GM.sf2"
+MAX_PENDING_JOBS = 4
+# chords are played live; set True to also keep a barcode_code_<ts>.mid per scan
+SAVE_MIDI = False
+
 SCALES = {
     "major":      [0, 2, 4, 5, 7, 9, 11],
     "minor":      [0, 2, 3, 5, 7, 8, 10],
     "pentatonic": [0, 2, 4, 7, 9],
 }
 
+# characters that count as a black bar, as a lookup table indexed by code point.
+# '█' (U+2588) doesn't fit in the table and is checked separately.
+_BAR_MASK = bytearray(256)
+for _c in b"|1#Xx":
+    _BAR_MASK[_c] = 1
+_FULL_BLOCK = ord("█")
+
+# choices params_from_text picks from
+_SCALES_T = ("major", "minor", "pentatonic")
+_PROGRAMS_T = (81, 100, 104, 84, 85, 86)
+_UNITS_T = (0.125, 0.25, 0.375, 0.5)
+
 def clamp(v: int, lo: int, hi: int) -> int:
     return max(lo, min(hi, v))
 
+@lru_cache(maxsize=1024)
 def params_from_text(text: str):
-    h = hashlib.sha256(text.encode("utf-8", errors="ignore")).digest()
-
-    scales = ["major", "minor", "pentatonic"]
-    programs = [81, 100, 104, 84, 85, 86] 
+    # only 6 bytes are used, so a short blake2b digest is enough
+    h = hashlib.blake2b(text.encode("utf-8", errors="ignore"), digest_size=6).digest()
 
-    scale = scales[h[0] % len(scales)]
+    scale = _SCALES_T[h[0] % len(_SCALES_T)]
     bpm = 70 + (h[1] % 121)          # 70..190
     base_note = 36 + (h[2] % 25)     # 36..60
-    unit_beats = [0.125, 0.25, 0.375, 0.5][h[3] % 4]
-    program = programs[h[4] % len(programs)]
+    unit_beats = _UNITS_T[h[3] % len(_UNITS_T)]
+    program = _PROGRAMS_T[h[4] % len(_PROGRAMS_T)]
     chord_duration = 1.0 + (h[5] % 8) * 0.5   # 1.0..5.0
 
     return scale, bpm, base_note, unit_beats, program, chord_duration
 
 
+def _ascii_kernel(
+    s: str,
+    base_note: int,
+    scale: str,
+    min_run: int,
+    max_run: int,
+) -> Tuple[List[int], List[int], List[int]]:
+    # pitch / velocity / run-length lists, one entry per run, for an already
+    # stripped, non-empty string
+    scale_ints = SCALES.get(scale.lower())
+    if not scale_ints:
+        raise ValueError(f"Unknown scale: {scale}. Use one of {list(SCALES.keys())}")
+    n_scale = len(scale_ints)
+
+    # run-length encode
+    rle: List[Tuple[str, int]] = []
+    prev = s[0]
+    cnt = 1
+    for ch in s[1:]:
+        if ch == prev:
+            cnt += 1
+        else:
+            rle.append((prev, cnt))
+            prev, cnt = ch, 1
+    rle.append((prev, cnt))
+
+    pitches: List[int] = []
+    vels: List[int] = []
+    runs: List[int] = []
+    for i, (ch, run) in enumerate(rle):
+        # clamp() inlined: a call per run costs more than the rest of the body
+        run = min_run if run < min_run else max_run if run > max_run else run
+        c = ord(ch)
+        pitch = base_note + scale_ints[(c + i + run) % n_scale]
+
+        # black bars go up an octave and play louder
+        if _BAR_MASK[c] if c < 0x100 else c == _FULL_BLOCK:
+            pitch += 12
+            vels.append(95)
+        else:
+            vels.append(55)
+        pitches.append(0 if pitch < 0 else 127 if pitch > 127 else pitch)
+        runs.append(run)
+
+    return pitches, vels, runs
+
+
 def ascii_to_notes(
     barcode_ascii: str,
     base_note: int = 48,       
@@ -55,39 +141,80 @@ def ascii_to_notes(
     if not s:
         return []
 
-    # run-length encode
-    runs: List[Tuple[str, int]] = []
-    prev = s[0]
-    cnt = 1
-    for ch in s[1:]:
-        if ch == prev:
-            cnt += 1
-        else:
-            runs.append((prev, cnt))
-            prev, cnt = ch, 1
-    runs.append((prev, cnt))
-
-    scale_ints = SCALES.get(scale.lower())
-    if not scale_ints:
-        raise ValueError(f"Unknown scale: {scale}. Use one of {list(SCALES.keys())}")
+    pitch, velocity, runs = _ascii_kernel(s, base_note, scale, min_run, max_run)
 
-    notes: List[Note] = []
-    for i, (ch, run) in enumerate(runs):
-        run = clamp(run, min_run, max_run)
+    notes = [
+        Note(pitch=p, duration_beats=run * unit_beats, velocity=v)
+        for p, run, v in zip(pitch, runs, velocity)
+    ]
 
-        is_bar = ch in ("|", "1", "█", "#", "X", "x")
+    return notes
 
-        degree = scale_ints[(ord(ch) + i + run) % len(scale_ints)]
 
-        pitch = base_note + degree + (12 if is_bar else 0)
-        pitch = clamp(pitch, 0, 127)
-        velocity = 95 if is_bar else 55
+def ascii_to_chord_pitches(
+    barcode_ascii: str,
+    base_note: int = 48,
+    scale: str = "minor",
+    min_run: int = 1,
+    max_run: int = 12,
+) -> Tuple[int, int]:
+    # same mapping as ascii_to_notes, folded straight into a chord:
+    # bit p of mask is set when pitch p occurs (pitches are 0..127, so an int
+    # works as a 128-bit set) and vel is the mean velocity. mask is 0 for empty input.
+    s = barcode_ascii.replace("\r", "").replace("\n", "")
+    if not s:
+        return 0, 0
 
-        duration = run * unit_beats
-        notes.append(Note(pitch=pitch, duration_beats=duration, velocity=velocity))
+    pitch, velocity, _ = _ascii_kernel(s, base_note, scale, min_run, max_run)
 
-    return notes
+    mask = 0
+    for p in pitch:
+        mask |= 1 << p
 
+    # avg
+    vel = int(sum(velocity) / len(velocity))
+    vel = max(1, min(127, vel))
+    return mask, vel
+
+
+def _mask_pitches(mask: int):
+    # yield set bits lowest first, i.e. pitches in ascending order
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def _write_varlen(buf: bytearray, n: int) -> None:
+    # MIDI variable-length quantity: 7 bits per byte, MSB set on all but the last
+    out = [n & 0x7F]
+    n >>= 7
+    while n:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buf.extend(reversed(out))
+
+
+def _track_header(bpm: int, program: int, channel: int) -> bytearray:
+    tempo = int(round(60_000_000 / bpm))
+    track = bytearray(b"\x00\xff\x51\x03")
+    track += tempo.to_bytes(3, "big")
+    track += bytes((0x00, 0xC0 | channel, program))
+    return track
+
+
+def _write_midi_file(out_path: str, track: bytearray, ticks_per_beat: int) -> None:
+    # end_of_track, then a single-track type 1 file in one write()
+    track += b"\x00\xff\x2f\x00"
+    data = (
+        b"MThd\x00\x00\x00\x06\x00\x01\x00\x01"
+        + ticks_per_beat.to_bytes(2, "big")
+        + b"MTrk"
+        + len(track).to_bytes(4, "big")
+        + track
+    )
+    with open(out_path, "wb") as f:
+        f.write(data)
 
 def notes_to_midi_file(
     notes: List[Note],
@@ -97,118 +224,206 @@ def notes_to_midi_file(
     channel: int = 0,
     ticks_per_beat: int = 480,
 ) -> None:
-    mid = mido.MidiFile(ticks_per_beat=ticks_per_beat,type=1)
-    track = mido.MidiTrack()
-    mid.tracks.append(track)
+    track = _track_header(bpm, program, channel)
 
-    track.append(mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(bpm), time=0))
-    track.append(mido.Message("program_change", program=program, channel=channel, time=0))
+    # note_off is sent as note_on with velocity 0, so a single status byte covers
+    # the whole stream (running status) and each event is just delta, pitch, velocity
+    for i, n in enumerate(notes):
+        track.append(0x00)
+        if i == 0:
+            track.append(0x90 | channel)
+        track += bytes((n.pitch, n.velocity))
+        _write_varlen(track, int(n.duration_beats * ticks_per_beat))
+        track += bytes((n.pitch, 0))
 
-    for n in notes:
-        track.append(mido.Message("note_on", note=n.pitch, velocity=n.velocity, channel=channel, time=0))
-        track.append(mido.Message(
-            "note_off",
-            note=n.pitch,
-            velocity=0,
-            channel=channel,
-            time=int(n.duration_beats * ticks_per_beat),
-        ))
-
-    mid.save(out_path)
+    _write_midi_file(out_path, track, ticks_per_beat)
 
 def notes_to_midi_chord_file(
-    notes,
+    mask: int,
+    vel: int,
     out_path: str,
     bpm: int = 120,
     program: int = 0,
     channel: int = 0,
     ticks_per_beat: int = 480,
     chord_duration_beats: float = 3.0,  
-):
-    mid = mido.MidiFile(ticks_per_beat=ticks_per_beat)
-    track = mido.MidiTrack()
-    mid.tracks.append(track)
-
-    track.append(mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(bpm), time=0))
-    track.append(mido.Message("program_change", program=program, channel=channel, time=0))
-
-    # remove dup pitch
-    pitches = sorted({n.pitch for n in notes})
-    if not pitches:
+) -> None:
+    # mask / vel as returned by ascii_to_chord_pitches, duplicates are already gone
+    if not mask:
         raise ValueError("No notes to write")
 
-    # avg
-    vel = int(sum(getattr(n, "velocity", 80) for n in notes) / len(notes))
-    vel = max(1, min(127, vel))
+    track = _track_header(bpm, program, channel)
+    low = (mask & -mask).bit_length() - 1
+    rest = mask & (mask - 1)
 
-    # all note_on
-    first = True
-    for p in pitches:
-        track.append(mido.Message("note_on", note=p, velocity=vel, channel=channel, time=0 if first else 0))
-        first = False
+    # all note_on, running status after the first one
+    track += bytes((0x00, 0x90 | channel, low, vel))
+    for p in _mask_pitches(rest):
+        track += bytes((0x00, p, vel))
 
-    # wait for chord_duration ，all note_off
+    # wait for chord_duration ，all note_off (note_on velocity 0, keeps the running status)
     off_time = int(chord_duration_beats * ticks_per_beat)
-    first = True
-    for p in pitches:
-        track.append(mido.Message("note_off", note=p, velocity=0, channel=channel, time=off_time if first else 0))
-        first = False
+    _write_varlen(track, off_time)
+    track += bytes((low, 0))
+    for p in _mask_pitches(rest):
+        track += bytes((0x00, p, 0))
 
-    mid.save(out_path)
+    _write_midi_file(out_path, track, ticks_per_beat)
 
 
 def barcode_ascii_to_midi(
     barcode_ascii: str,
-    out_path: str = "barcode.mid",
-    bpm: int = 120,
-    scale: str = "minor",
-    base_note: int = 48,
-    unit_beats: float = 0.25,
-    program: int = 0,
-) -> None:
-    
-    scale, bpm, base_note, unit_beats, program, chord_duration = params_from_text(ch)
-
-    notes = ascii_to_notes(
+    out_path: Optional[str] = "barcode.mid",
+    bpm: Optional[int] = None,
+    scale: Optional[str] = None,
+    base_note: Optional[int] = None,
+    program: Optional[int] = None,
+    chord_duration_beats: Optional[float] = None,
+) -> Chord:
+    # anything not given explicitly is derived from the barcode text
+    if None in (bpm, scale, base_note, program, chord_duration_beats):
+        h_scale, h_bpm, h_base_note, _, h_program, h_chord_duration = params_from_text(barcode_ascii)
+        bpm = h_bpm if bpm is None else bpm
+        scale = h_scale if scale is None else scale
+        base_note = h_base_note if base_note is None else base_note
+        program = h_program if program is None else program
+        chord_duration_beats = h_chord_duration if chord_duration_beats is None else chord_duration_beats
+
+    mask, vel = ascii_to_chord_pitches(
         barcode_ascii=barcode_ascii,
         base_note=base_note,
         scale=scale,
-        unit_beats=unit_beats,
     )
-    if not notes:
+    if not mask:
         raise ValueError("Input barcode_ascii is empty after stripping newlines.")
-    #notes_to_midi_file(notes, out_path, bpm=bpm, program=program)
-    #notes_to_midi_chord_file(notes, out_path, bpm=bpm, program=program, chord_duration_beats=chord_duration)
-    notes_to_midi_chord_file(notes, out_path, bpm=bpm, program=program, chord_duration_beats=3.0)
-    #notes_to_midi_chord_file(notes, out_path, bpm=bpm, program=program)
-
-def play_with_fluidsynth(mid_path: str, sf2_path: str = "/usr/share/sounds/sf2/FluidR3_GM.sf2"):
-    #subprocess.run(["fluidsynth","-ni", "-a", "alsa", "-o", "audio.alsa.device=hw:1", "-g", "1.0", sf2_path, mid_path], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    subprocess.run(["fluidsynth","-ni", "-a", "alsa", "-g", "1.0", sf2_path, mid_path], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # out_path=None only builds the chord, e.g. when it is played live and not kept
+    if out_path is not None:
+        notes_to_midi_chord_file(mask, vel, out_path, bpm=bpm, program=program, chord_duration_beats=chord_duration_beats)
+    return Chord(mask=mask, velocity=vel, duration_beats=chord_duration_beats, bpm=bpm, program=program)
+
+# one writer for every scan; its state is reset on each render
+_WRITER = ImageWriter()
+
+@lru_cache(maxsize=256)
+def _render_png_bytes(ch: str) -> bytes:
+    # render in memory; deflate level 1 is much faster than the default and CUPS doesn't care.
+    # cached because the same barcode is often scanned again
+    img = Code128(ch, writer=_WRITER).render()
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+class CupsPrinter:
+    """Submits print jobs to the default CUPS destination in-process, falling back
+    to `lp` when pycups or cupsd isn't available. Checked once at startup."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.conn = None
+        self.name = None
+        self.ready = True
+        if cups is None:
+            print("pycups not installed, printing through lp")
+            return
+        try:
+            conn = cups.Connection()
+            self.name = conn.getDefault()
+            printers = conn.getPrinters()
+        except (RuntimeError, cups.IPPError):
+            print("cupsd not reachable, printing through lp")
+            return
+        if self.name is None or self.name not in printers:
+            # lp would fail the same way
+            print("No default printer, printing is disabled for this session")
+            self.ready = False
+        elif printers[self.name]["printer-state"] == cups.IPP_PRINTER_STOPPED:
+            print(f"Printer {self.name} is stopped, printing is disabled for this session")
+            self.ready = False
+        else:
+            self.conn = conn
+
+    def print_png(self, png: bytes, title: str) -> None:
+        if self.conn is None:
+            # lp reads the job from stdin when no file is given
+            subprocess.run(["lp", "-o", "fit-to-page"], input=png)
+            return
+        # stream the PNG into the job, same as `lp -o fit-to-page` but without the fork
+        with self._lock:
+            job_id = self.conn.createJob(self.name, title, {"fit-to-page": "true"})
+            self.conn.startDocument(self.name, job_id, title, "image/png", 1)
+            self.conn.writeRequestData(png, len(png))
+            self.conn.finishDocument(self.name)
+
+class FluidSynthPlayer:
+    """Keeps one FluidSynth instance alive so the SoundFont is loaded once per session."""
+
+    def __init__(self, sf2_path: str = SF2_PATH, driver: str = "alsa", gain: float = 1.0):
+        if fluidsynth is None:
+            raise RuntimeError("pyfluidsynth is not installed (see setup.sh)")
+        self.fs = fluidsynth.Synth(gain=gain)
+        self.fs.start(driver=driver)
+        self.sfid = self.fs.sfload(sf2_path)
+
+    def play_chord(self, chord: Chord, channel: int = 0) -> None:
+        self.fs.program_select(channel, self.sfid, 0, chord.program)
+        for p in _mask_pitches(chord.mask):
+            self.fs.noteon(channel, p, chord.velocity)
+        time.sleep(chord.seconds)
+        for p in _mask_pitches(chord.mask):
+            self.fs.noteoff(channel, p)
+
+    def close(self) -> None:
+        self.fs.delete()
+
+def _submit(exe: ThreadPoolExecutor, slots: threading.BoundedSemaphore, fn, *args) -> None:
+    # blocks once too many jobs are pending, so a slow printer can't queue up unbounded work
+    slots.acquire()
+    fut = exe.submit(fn, *args)
+
+    def _done(f):
+        slots.release()
+        if f.exception() is not None:
+            print(f"{fn.__name__} failed: {f.exception()}")
+
+    fut.add_done_callback(_done)
 
 if __name__ == "__main__":
 
     #barcode_ascii = "MЗE ODB0A010 00"
     #barcode_ascii = "XXXXJ102800309"
-    while(True):
-        #ch="Test Barcode"
-        ch = input('scan barcode\n')
-        print(f"{ch}")
-        current_timestamp = time.time()
-        filename = f"code_{int(current_timestamp)}"
-        my_code = Code128(ch, writer=ImageWriter())        
-        my_code.save(f"{filename}")
-        out = f"barcode_{filename}.mid"
-
-        barcode_ascii_to_midi(
-            ch,
-            out_path=out,
-            bpm=130,
-            scale="pentatonic",
-            base_note=50,
-            unit_beats=0.25,
-            program=81,
-        )
-        play_with_fluidsynth(mid_path=out)
-
-        subprocess.run(["lp", "-o", "fit-to-page", f"./{filename}.png"])
+    player = FluidSynthPlayer()
+    printer = CupsPrinter()
+    # play + print run in the background so the next scan can be read right away.
+    # One worker each: chords play one after another on the shared channel, and a
+    # slow printer or a long chord doesn't hold up the other
+    audio = ThreadPoolExecutor(max_workers=1)
+    audio_slots = threading.BoundedSemaphore(MAX_PENDING_JOBS)
+    printing = ThreadPoolExecutor(max_workers=1)
+    print_slots = threading.BoundedSemaphore(MAX_PENDING_JOBS)
+    try:
+        while(True):
+            #ch="Test Barcode"
+            ch = input('scan barcode\n')
+            print(f"{ch}")
+            current_timestamp = time.time()
+            filename = f"code_{int(current_timestamp)}"
+            out = f"barcode_{filename}.mid" if SAVE_MIDI else None
+
+            chord = barcode_ascii_to_midi(
+                ch,
+                out_path=out,
+                bpm=130,
+                scale="pentatonic",
+                base_note=50,
+                program=81,
+                chord_duration_beats=3.0,
+            )
+            _submit(audio, audio_slots, player.play_chord, chord)
+            if printer.ready:
+                _submit(printing, print_slots, printer.print_png, _render_png_bytes(ch), filename)
+    except (KeyboardInterrupt, EOFError):
+        print("Stopping program")
+    finally:
+        printing.shutdown(wait=True)
+        audio.shutdown(wait=True)
+        player.close()
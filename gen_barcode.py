@@ -1,16 +1,17 @@
 
-import time
+import io
 import subprocess
 from barcode import Code128
 from barcode.writer import ImageWriter
 
+writer = ImageWriter()
 while(True):
     #ch="Test Barcode"
     ch = input('scan barcode')
     print(f"{ch}")
-    current_timestamp = time.time()
-    filename = f"code_{int(current_timestamp)}"
-    my_code = Code128(ch, writer=ImageWriter())        
-    my_code.save(f"{filename}")
+    img = Code128(ch, writer=writer).render()
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", compress_level=1)
 
-    subprocess.run(["lp", "-o", "fit-to-page", f"./{filename}.png"])
+    # lp reads the job from stdin when no file is given
+    subprocess.run(["lp", "-o", "fit-to-page"], input=buf.getvalue())
@@ -12,10 +12,12 @@ mid.tracks.append(track)
 
 # 3. 設定轉換規則 (Mapping)
 # 我們將每個字元的編碼轉換成 0-127 的 MIDI 音高
+# 直接用 raw bytes 建 Message（from_bytes 不走 keyword 檢查），最後一次 extend 進 track
+msgs = []
 for char in data_string:
     if char == " ":
         # 遇到空白鍵，插入一個短暫的休止符（時間延遲，但不發聲）
-        track.append(Message('note_off', note=0, velocity=0, time=240))
+        msgs.append(Message.from_bytes((0x80, 0, 0), time=240))
     else:
         # 將字元轉為 Unicode 數字，並限制在 0-127 範圍內
         # 如果你希望聲音高一點，可以 +12 或 +24
@@ -26,9 +28,10 @@ for char in data_string:
         if note_value > 108: note_value -= 24
 
         # Note On (發聲), velocity (力度), time (距離上一音的時間)
-        track.append(Message('note_on', note=note_value, velocity=80, time=0))
+        msgs.append(Message.from_bytes((0x90, note_value, 80), time=0))
         # Note Off (停聲), 持續時間 240 ticks (約 1/4 拍)
-        track.append(Message('note_off', note=note_value, velocity=80, time=240))
+        msgs.append(Message.from_bytes((0x80, note_value, 80), time=240))
+track.extend(msgs)
 
 # 4. 存檔
 out='output_code_sound.mid'
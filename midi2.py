@@ -1,8 +1,6 @@
 from dataclasses import dataclass
 from typing import List, Tuple
 import mido
-import pygame
-import pygame.midi
 import time
 import subprocess
 
@@ -98,15 +96,17 @@ def notes_to_midi_file(
     track.append(mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(bpm), time=0))
     track.append(mido.Message("program_change", program=program, channel=channel, time=0))
 
+    # from_bytes 跳過 Message 的 keyword 檢查；先收集成 list 再一次 extend
+    note_on = 0x90 | channel
+    note_off = 0x80 | channel
+    msgs = []
     for n in notes:
-        track.append(mido.Message("note_on", note=n.pitch, velocity=n.velocity, channel=channel, time=0))
-        track.append(mido.Message(
-            "note_off",
-            note=n.pitch,
-            velocity=0,
-            channel=channel,
+        msgs.append(mido.Message.from_bytes((note_on, n.pitch, n.velocity), time=0))
+        msgs.append(mido.Message.from_bytes(
+            (note_off, n.pitch, 0),
             time=int(n.duration_beats * ticks_per_beat),
         ))
+    track.extend(msgs)
 
     mid.save(out_path)
 
@@ -136,17 +136,15 @@ def notes_to_midi_chord_file(
     vel = max(1, min(127, vel))
 
     # 同時 note_on
-    first = True
-    for p in pitches:
-        track.append(mido.Message("note_on", note=p, velocity=vel, channel=channel, time=0 if first else 0))
-        first = False
+    msgs = [mido.Message.from_bytes((0x90 | channel, p, vel), time=0) for p in pitches]
 
     # 等 chord_duration 後，全部 note_off
     off_time = int(chord_duration_beats * ticks_per_beat)
     first = True
     for p in pitches:
-        track.append(mido.Message("note_off", note=p, velocity=0, channel=channel, time=off_time if first else 0))
+        msgs.append(mido.Message.from_bytes((0x80 | channel, p, 0), time=off_time if first else 0))
         first = False
+    track.extend(msgs)
 
     mid.save(out_path)
 
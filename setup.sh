@@ -1,2 +1,2 @@
-pip install mido pygame
-sudo apt-get install -y fluidsynth fluid-soundfont-gm
+sudo apt-get install -y fluidsynth fluid-soundfont-gm libcups2-dev
+pip install mido pyfluidsynth pycups
@@ -5,6 +5,74 @@ import time
 from barcode import Code128
 from barcode.writer import ImageWriter
 
+# HID keycode -> [unshifted, shifted] character. Only relevant codes are used here.
+_CONV_TABLE = {
+    0:['', ''],
+    4:['a', 'A'],
+    5:['b', 'B'],
+    6:['c', 'C'],
+    7:['d', 'D'],
+    8:['e', 'E'],
+    9:['f', 'F'],
+    10:['g', 'G'],
+    11:['h', 'H'],
+    12:['i', 'I'],
+    13:['j', 'J'],
+    14:['k', 'K'],
+    15:['l', 'L'],
+    16:['m', 'M'],
+    17:['n', 'N'],
+    18:['o', 'O'],
+    19:['p', 'P'],
+    20:['q', 'Q'],
+    21:['r', 'R'],
+    22:['s', 'S'],
+    23:['t', 'T'],
+    24:['u', 'U'],
+    25:['v', 'V'],
+    26:['w', 'W'],
+    27:['x', 'X'],
+    28:['y', 'Y'],
+    29:['z', 'Z'],
+    30:['1', '!'],
+    31:['2', '@'],
+    32:['3', '#'],
+    33:['4', '$'],
+    34:['5', '%'],
+    35:['6', '^'],
+    36:['7' ,'&'],
+    37:['8', '*'],
+    38:['9', '('],
+    39:['0', ')'],
+    40:['\n', '\n'],
+    41:['\x1b', '\x1b'],
+    42:['\b', '\b'],
+    43:['\t', '\t'],
+    44:[' ', ' '],
+    45:['_', '_'],
+    46:['=', '+'],
+    47:['[', '{'],
+    48:[']', '}'],
+    49:['\\', '|'],
+    50:['#', '~'],
+    51:[';', ':'],
+    52:["'", '"'],
+    53:['`', '~'],
+    54:[',', '<'],
+    55:['.', '>'],
+    56:['/', '?'],
+    100:['\\', '|'],
+    103:['=', '='],
+}
+
+# The same mapping flattened into 256-byte tables indexed by keycode, built once.
+# 0 means "no character", 0xFF means the keycode is not in the table.
+_HID_LO = bytearray(b'\xff' * 256)
+_HID_HI = bytearray(b'\xff' * 256)
+for _code, (_lo, _hi) in _CONV_TABLE.items():
+    _HID_LO[_code] = ord(_lo) if _lo else 0
+    _HID_HI[_code] = ord(_hi) if _hi else 0
+
 def hid2ascii(raw_data):
     """The USB HID device sends an 8-byte code for every character. This
     routine converts the HID code to an ASCII character.
@@ -19,85 +87,22 @@ def hid2ascii(raw_data):
     #   array('B', [0, 0, 23, 0, 0, 0, 0, 0])   # t
     #   array('B', [0, 0, 19, 0, 0, 0, 0, 0])   # p
     #   array('B', [2, 0, 51, 0, 0, 0, 0, 0])   # :
-    lst_list = [raw_data[i:i + 8] for i in range(0, len(raw_data), 8)]
-    out = ''
-    #print(lst_list)
-    for lst in lst_list:
-        #print(lst)
-        assert len(lst) == 8, 'Invalid data length (needs 8 bytes)'
-        conv_table = {
-            0:['', ''],
-            4:['a', 'A'],
-            5:['b', 'B'],
-            6:['c', 'C'],
-            7:['d', 'D'],
-            8:['e', 'E'],
-            9:['f', 'F'],
-            10:['g', 'G'],
-            11:['h', 'H'],
-            12:['i', 'I'],
-            13:['j', 'J'],
-            14:['k', 'K'],
-            15:['l', 'L'],
-            16:['m', 'M'],
-            17:['n', 'N'],
-            18:['o', 'O'],
-            19:['p', 'P'],
-            20:['q', 'Q'],
-            21:['r', 'R'],
-            22:['s', 'S'],
-            23:['t', 'T'],
-            24:['u', 'U'],
-            25:['v', 'V'],
-            26:['w', 'W'],
-            27:['x', 'X'],
-            28:['y', 'Y'],
-            29:['z', 'Z'],
-            30:['1', '!'],
-            31:['2', '@'],
-            32:['3', '#'],
-            33:['4', '$'],
-            34:['5', '%'],
-            35:['6', '^'],
-            36:['7' ,'&'],
-            37:['8', '*'],
-            38:['9', '('],
-            39:['0', ')'],
-            40:['\n', '\n'],
-            41:['\x1b', '\x1b'],
-            42:['\b', '\b'],
-            43:['\t', '\t'],
-            44:[' ', ' '],
-            45:['_', '_'],
-            46:['=', '+'],
-            47:['[', '{'],
-            48:[']', '}'],
-            49:['\\', '|'],
-            50:['#', '~'],
-            51:[';', ':'],
-            52:["'", '"'],
-            53:['`', '~'],
-            54:[',', '<'],
-            55:['.', '>'],
-            56:['/', '?'],
-            100:['\\', '|'],
-            103:['=', '='],
-            }
-
+    assert len(raw_data) % 8 == 0, 'Invalid data length (needs 8 bytes)'
+    mv = memoryview(raw_data)
+    out = bytearray()
+    for i in range(0, len(mv), 8):
         # A 2 in first byte seems to indicate to shift the key. For example
         # a code for ';' but with 2 in first byte really means ':'.
-        if lst[0] == 2:
-            shift = 1
-        else:
-            shift = 0
-            
+        tbl = _HID_HI if mv[i] == 2 else _HID_LO
+
         # The character to convert is in the third byte
-        ch = lst[2]
-        if ch not in conv_table:
+        c = tbl[mv[i + 2]]
+        if c == 0xFF:
             print("Warning: data not in conversion table")
             return ''
-        out += conv_table[ch][shift]
-    return out
+        if c:
+            out.append(c)
+    return out.decode('latin-1')
 
 
 # Find our device using the VID (Vendor ID) and PID (Product ID)
@@ -134,12 +139,15 @@ assert ep is not None, "Endpoint for USB device not found. Something is wrong."
 # Loop through a series of 8-byte transactions and convert each to an
 # ASCII character. Print output after 0.5 seconds of no data.
 line = ''
-result = []
 
+# One JSON object per line, appended per scan instead of rewriting the whole
+# history. `jq -s . result.jsonl` gives the old array form back, and an existing
+# result.json can be carried over with `jq -c '.[]' result.json >> result.jsonl`.
+filename = "result.jsonl"
+result_file = open(filename, 'a', buffering=1)
 
-filename = "result.json"
-with open(filename, 'r') as f:
-    result = json.load(f)
+# one barcode image writer for the whole session instead of one per scan
+writer = ImageWriter()
 
 while True:
     try:
@@ -150,20 +158,20 @@ while True:
             print(data)
             current_timestamp = time.time()
             ch = hid2ascii(data).rstrip('\n')
-            result.append({"Barcode":f"{ch}","Time":f"{current_timestamp}"})
             print(ch)
 
-            my_code = Code128(ch, writer=ImageWriter())        
+            my_code = Code128(ch, writer=writer)
             my_code.save(f"code_{int(current_timestamp)}")
     
-            with open(filename, 'w') as f:
-                json.dump(result, f, indent=4) # indent=4 for pretty-printing
-                print(f"Data successfully written to {filename}")
+            record = {"Barcode":f"{ch}","Time":f"{current_timestamp}"}
+            result_file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            print(f"Data successfully written to {filename}")
             #line += ch
         else:
             print('no data')
     except KeyboardInterrupt:
         print("Stopping program")
+        result_file.close()
         dev.reset()
         if needs_reattach:
             dev.attach_kernel_driver(0)